@@ -1,32 +1,60 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, date
-from dateutil import parser
 import plotly.express as px
-from sqlalchemy import create_engine, text
+import ahocorasick
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.exc import IntegrityError
 import hashlib
+import hmac
 import os
+import re
+from functools import lru_cache
+from typing import Optional, Union
 
 # -----------------------
 # Database helpers
 # -----------------------
 DB_NAME = "expenses.db"
 
+@st.cache_resource
 def get_engine():
-    return create_engine(f"sqlite:///{DB_NAME}", connect_args={"check_same_thread": False})
+    engine = create_engine(f"sqlite:///{DB_NAME}", connect_args={"check_same_thread": False}, pool_pre_ping=False)
+
+    # synchronous/temp_store/cache_size are per-connection, so apply them to every pooled connection
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-20000")
+        cursor.close()
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    return engine
 
-def verify_password(password: str, hashed: str) -> bool:
-    return hash_password(password) == hashed
+def _scrypt(password: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=2**15, r=8, p=1, maxmem=64 * 1024 * 1024, dklen=32)
 
-def get_user_id(username: str):
-    engine = get_engine()
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT id FROM users WHERE username=:u"), {"u": username}).fetchone()
-        return result[0] if result else None
+@lru_cache(maxsize=64)
+def _derive(password: str, salt: bytes) -> bytes:
+    # Verify path only: a repeat login against the same stored salt skips the slow scrypt call
+    return _scrypt(password, salt)
+
+def hash_password(password: str, salt: Optional[bytes] = None) -> bytes:
+    # Stored as raw bytes: 16-byte salt followed by the 32-byte scrypt digest
+    if salt is None:
+        # Fresh salt (registration) can never be looked up again, so don't cache it
+        salt = os.urandom(16)
+        return salt + _scrypt(password, salt)
+    return salt + _derive(password, salt)
+
+def verify_password(password: str, hashed: Union[bytes, str]) -> bool:
+    if isinstance(hashed, str):
+        # Legacy unsalted SHA-256 hex digest
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+    return hmac.compare_digest(hash_password(password, hashed[:16]), hashed)
 
 def init_db():
     engine = get_engine()
@@ -36,7 +64,7 @@ def init_db():
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
+            password_hash BLOB NOT NULL
         )
         """))
         # Create expenses table if not exists
@@ -55,6 +83,8 @@ def init_db():
         colnames = [r[1] for r in res]
         if "user_id" not in colnames:
             conn.execute(text("ALTER TABLE expenses ADD COLUMN user_id INTEGER"))
+        # Composite index for the per-user date-range queries; users.username is already indexed by UNIQUE
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_expenses_user_dt ON expenses(user_id, dt)"))
     return engine
 
 engine = init_db()
@@ -79,47 +109,141 @@ KEYWORD_CATEGORY_MAP = {
     "rent": "Rent"
 }
 
+_KW_ITEMS = tuple(KEYWORD_CATEGORY_MAP.items())
+_KW_CHOICES = tuple(cat for _, cat in _KW_ITEMS)
+
+# Single-pass keyword matcher; values carry the map position so earlier keywords still win
+KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for _i, (_kw, _cat) in enumerate(_KW_ITEMS):
+    KEYWORD_AUTOMATON.add_word(_kw, (_i, _cat))
+KEYWORD_AUTOMATON.make_automaton()
+
+@lru_cache(maxsize=4096)
 def auto_categorize(description: str) -> str:
-    desc = (description or "").lower()
-    for kw, cat in KEYWORD_CATEGORY_MAP.items():
-        if kw in desc:
-            return cat
+    # Cached: recurring descriptions ("Uber", "Netflix") are the common case
+    if not description:
+        return "Misc"
+    desc = description.lower()
+    matches = [value for _, value in KEYWORD_AUTOMATON.iter(desc)]
+    if matches:
+        return min(matches)[1]
     return "Misc"
 
+def auto_categorize_series(descriptions: pd.Series, _items=_KW_ITEMS, _choices=_KW_CHOICES) -> pd.Series:
+    # Vectorized auto_categorize: np.select keeps the first-match-wins order of the map
+    desc = descriptions.fillna("").astype(str).str.lower()
+    conditions = [desc.str.contains(kw, regex=False).to_numpy() for kw, _ in _items]
+    return pd.Series(np.select(conditions, _choices, default="Misc"), index=descriptions.index)
+
 # -----------------------
 # Data operations
 # -----------------------
 def add_expense(dt: str, amount: float, description: str, category: str, user_id: int):
-    engine = get_engine()
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         conn.execute(
             text("INSERT INTO expenses (dt, amount, description, category, user_id) VALUES (:dt,:amount,:desc,:cat,:uid)"),
             {"dt": dt, "amount": amount, "desc": description, "cat": category, "uid": user_id}
         )
+    clear_expense_caches()
 
-def fetch_expenses(start_date=None, end_date=None, user_id=None):
-    engine = get_engine()
+def add_expenses(rows: list):
+    # rows: list of {"dt", "amount", "desc", "cat", "uid"} dicts, inserted in one transaction
+    if not rows:
+        return
+    with get_engine().begin() as conn:
+        conn.execute(
+            text("INSERT INTO expenses (dt, amount, description, category, user_id) VALUES (:dt,:amount,:desc,:cat,:uid)"),
+            rows
+        )
+    clear_expense_caches()
+
+def _parse_date(value: str):
+    ts = pd.to_datetime(value, errors='coerce')
+    if pd.notna(ts) and ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    # Parse as text so numeric dates (20240105) aren't read as epoch values, and drop any
+    # trailing zone after the time so each row keeps its own wall-clock date
+    text_values = (values.astype(str)
+                   .str.replace(r'(?:(?<=\d)Z|\s*(?:UTC|GMT))$', '', regex=True, flags=re.I)
+                   .str.replace(r'(\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)\s*[+-]\d{2}(?::?\d{2})?$', r'\1', regex=True))
+    try:
+        parsed = pd.to_datetime(text_values, errors='coerce', format='mixed')
+    except ValueError:
+        parsed = None
+    if parsed is None or not pd.api.types.is_datetime64_any_dtype(parsed):
+        # Offsets the strip doesn't recognise mix aware and naive values; fall back per value
+        # so an odd row only drops itself
+        parsed = pd.to_datetime(text_values.map(_parse_date), errors='coerce')
+    return parsed
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_expenses(start_date=None, end_date=None, user_id=None, q=None):
     query = "SELECT id, dt, amount, description, category FROM expenses WHERE user_id=:uid"
     params = {"uid": user_id}
     if start_date and end_date:
-        query += " AND date(dt) BETWEEN :start AND :end"
+        # Compare dt directly (not date(dt)) so idx_expenses_user_dt can serve the range
+        query += " AND dt BETWEEN :start AND :end || ' 23:59:59'"
         params.update({"start": start_date, "end": end_date})
-    df = pd.read_sql_query(text(query), engine, params=params)
+    if q:
+        # Case-insensitive substring match; escape LIKE wildcards in the user's text
+        query += " AND (description LIKE :q ESCAPE '\\' OR category LIKE :q ESCAPE '\\')"
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params["q"] = f"%{escaped}%"
+    df = pd.read_sql_query(text(query), get_engine(), params=params)
     if not df.empty:
         df['dt'] = pd.to_datetime(df['dt'])
         df = df.sort_values('dt', ascending=False)
     return df
 
-def export_csv(df: pd.DataFrame) -> bytes:
+@st.cache_data(ttl=60, show_spinner=False)
+def total_amount(user_id, start_date=None, end_date=None) -> float:
+    query = "SELECT COALESCE(SUM(amount), 0) FROM expenses WHERE user_id=:uid"
+    params = {"uid": user_id}
+    if start_date and end_date:
+        query += " AND dt BETWEEN :start AND :end || ' 23:59:59'"
+        params.update({"start": start_date, "end": end_date})
+    with get_engine().connect() as conn:
+        return float(conn.execute(text(query), params).scalar())
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cat_summary(user_id, start_date, end_date) -> pd.DataFrame:
+    query = """
+        SELECT category, SUM(amount) AS amount FROM expenses
+        WHERE user_id=:uid AND dt BETWEEN :start AND :end || ' 23:59:59'
+        GROUP BY category ORDER BY amount DESC
+    """
+    return pd.read_sql_query(text(query), get_engine(), params={"uid": user_id, "start": start_date, "end": end_date})
+
+@st.cache_data(ttl=60, show_spinner=False)
+def daily_summary(user_id, start_date, end_date) -> pd.DataFrame:
+    query = """
+        SELECT date(dt) AS date_only, SUM(amount) AS amount FROM expenses
+        WHERE user_id=:uid AND dt BETWEEN :start AND :end || ' 23:59:59'
+        GROUP BY date_only ORDER BY date_only
+    """
+    return pd.read_sql_query(text(query), get_engine(), params={"uid": user_id, "start": start_date, "end": end_date})
+
+def clear_expense_caches():
+    fetch_expenses.clear()
+    total_amount.clear()
+    cat_summary.clear()
+    daily_summary.clear()
+    build_csv.clear()
+
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def build_csv(user_id: int, start_date: str, end_date: str, q: str) -> bytes:
+    df = fetch_expenses(start_date, end_date, user_id=user_id, q=q)
     return df.to_csv(index=False).encode('utf-8')
 
 # -----------------------
 # Authentication helpers
 # -----------------------
 def register_user(username: str, password: str) -> bool:
-    engine = get_engine()
     try:
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             conn.execute(
                 text("INSERT INTO users (username, password_hash) VALUES (:u, :p)"),
                 {"u": username, "p": hash_password(password)}
@@ -128,16 +252,23 @@ def register_user(username: str, password: str) -> bool:
     except IntegrityError:
         return False
 
-def authenticate_user(username: str, password: str) -> bool:
-    engine = get_engine()
-    with engine.connect() as conn:
+def authenticate_user(username: str, password: str) -> Optional[int]:
+    # Returns the user's id on success so login needs no second lookup
+    with get_engine().connect() as conn:
         result = conn.execute(
-            text("SELECT password_hash FROM users WHERE username=:u"),
+            text("SELECT id, password_hash FROM users WHERE username=:u"),
             {"u": username}
         ).fetchone()
-        if result and verify_password(password, result[0]):
-            return True
-    return False
+        if not (result and verify_password(password, result[1])):
+            return None
+    if isinstance(result[1], str):
+        # Upgrade a legacy unsalted SHA-256 hash to salt||scrypt now that we have the password
+        with get_engine().begin() as conn:
+            conn.execute(
+                text("UPDATE users SET password_hash=:p WHERE id=:id"),
+                {"p": hash_password(password), "id": result[0]}
+            )
+    return result[0]
 
 # -----------------------
 # Session state for login
@@ -150,6 +281,7 @@ if 'user_id' not in st.session_state:
     st.session_state['user_id'] = None
 
 def logout():
+    _derive.cache_clear()
     st.session_state['logged_in'] = False
     st.session_state['username'] = None
     st.session_state['user_id'] = None
@@ -161,10 +293,11 @@ def login_form():
         password = st.text_input("Password", type="password")
         submit = st.form_submit_button("Login")
         if submit:
-            if authenticate_user(username, password):
+            uid = authenticate_user(username, password)
+            if uid is not None:
                 st.session_state['logged_in'] = True
                 st.session_state['username'] = username
-                st.session_state['user_id'] = get_user_id(username)
+                st.session_state['user_id'] = uid
                 st.success("Logged in successfully!")
                 st.rerun()
             else:
@@ -217,13 +350,11 @@ choice = st.sidebar.selectbox("Navigate", menu)
 if choice == "Home":
     st.subheader("Welcome!")
     st.markdown("Use the sidebar to navigate through the app.")
-    df_all = fetch_expenses(user_id=st.session_state['user_id'])
-    total = df_all['amount'].sum() if not df_all.empty else 0.0
+    total = total_amount(st.session_state['user_id'])
     st.metric("Total Expenses", f"₹{total:,.2f}")
     month_start = date.today().replace(day=1).strftime("%Y-%m-%d")
     month_end = date.today().strftime("%Y-%m-%d")
-    df_month = fetch_expenses(month_start, month_end, user_id=st.session_state['user_id'])
-    month_total = df_month['amount'].sum() if not df_month.empty else 0.0
+    month_total = total_amount(st.session_state['user_id'], month_start, month_end)
     st.metric(f"Expenses This Month", f"₹{month_total:,.2f}")
 
 # -----------------------
@@ -264,14 +395,11 @@ elif choice == "View & Export":
     if start_date > end_date:
         st.error("Start date cannot be after end date.")
     else:
-        df_view = fetch_expenses(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), user_id=st.session_state['user_id'])
-        if not df_view.empty and text_search.strip():
-            mask = df_view['description'].str.contains(text_search, case=False, na=False) | \
-                   df_view['category'].str.contains(text_search, case=False, na=False)
-            df_view = df_view[mask]
+        start_str, end_str = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+        df_view = fetch_expenses(start_str, end_str, user_id=st.session_state['user_id'], q=text_search.strip())
         st.dataframe(df_view.reset_index(drop=True))
         if not df_view.empty:
-            csv_bytes = export_csv(df_view)
+            csv_bytes = build_csv(st.session_state['user_id'], start_str, end_str, text_search.strip())
             st.download_button("Download CSV", data=csv_bytes, file_name=f"expenses_{start_date}_{end_date}.csv", mime="text/csv")
 
 # -----------------------
@@ -281,17 +409,15 @@ elif choice == "Visualizations":
     st.subheader("Visualizations")
     start_date = date.today().replace(day=1)
     end_date = date.today()
-    viz_df = fetch_expenses(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), user_id=st.session_state['user_id'])
-    if viz_df.empty:
+    cat_df = cat_summary(st.session_state['user_id'], start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    if cat_df.empty:
         st.info("No data for visualizations.")
     else:
-        cat_summary = viz_df.groupby('category')['amount'].sum().reset_index().sort_values('amount', ascending=False)
-        fig_pie = px.pie(cat_summary, names='category', values='amount', title="Spending by Category")
+        fig_pie = px.pie(cat_df, names='category', values='amount', title="Spending by Category")
         st.plotly_chart(fig_pie, use_container_width=True)
 
-        viz_df['date_only'] = viz_df['dt'].dt.date
-        daily_summary = viz_df.groupby('date_only')['amount'].sum().reset_index()
-        fig_bar = px.bar(daily_summary, x='date_only', y='amount', title="Daily Spending", labels={'date_only':'Date','amount':'Amount (₹)'})
+        daily_df = daily_summary(st.session_state['user_id'], start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+        fig_bar = px.bar(daily_df, x='date_only', y='amount', title="Daily Spending", labels={'date_only':'Date','amount':'Amount (₹)'})
         st.plotly_chart(fig_bar, use_container_width=True)
 
 # -----------------------
@@ -309,22 +435,24 @@ elif choice == "Bulk Import":
                 st.error("CSV must contain dt, amount, description columns")
             else:
                 csv_df.columns = [c.lower() for c in csv_df.columns]
-                inserted = 0
-                for _, row in csv_df.iterrows():
-                    try:
-                        dt_val = row.get("dt")
-                        amt = float(row.get("amount",0))
-                        desc = str(row.get("description",""))
-                        cat = row.get("category") if "category" in csv_df.columns else None
-                        if pd.isna(cat) or not cat:
-                            cat = auto_categorize(desc)
-                        dt_parsed = parser.parse(dt_val).date().strftime("%Y-%m-%d")
-                        if amt>0:
-                            add_expense(dt_parsed, amt, desc, cat, st.session_state['user_id'])
-                            inserted += 1
-                    except Exception:
-                        continue
-                st.success(f"Imported {inserted} records successfully.")
+                csv_df['description'] = csv_df['description'].astype(str)
+                suggested = auto_categorize_series(csv_df['description'])
+                if "category" in csv_df.columns:
+                    has_cat = csv_df['category'].notna() & (csv_df['category'].astype(str) != "")
+                    csv_df['category'] = csv_df['category'].where(has_cat, suggested)
+                else:
+                    csv_df['category'] = suggested
+                csv_df['amount'] = pd.to_numeric(csv_df['amount'], errors='coerce')
+                csv_df['dt'] = parse_dates(csv_df['dt'])
+                csv_df = csv_df[(csv_df['amount'] > 0) & csv_df['dt'].notna()].copy()
+                csv_df['dt'] = csv_df['dt'].dt.strftime("%Y-%m-%d")
+                uid = st.session_state['user_id']
+                rows = [
+                    {"dt": dt_val, "amount": float(amt), "desc": desc, "cat": cat, "uid": uid}
+                    for dt_val, amt, desc, cat in csv_df[['dt','amount','description','category']].itertuples(index=False, name=None)
+                ]
+                add_expenses(rows)
+                st.success(f"Imported {len(rows)} records successfully.")
         except Exception as e:
             st.error(f"Failed to import CSV: {e}")
 
@@ -336,28 +464,32 @@ elif choice == "Admin":
 
     # Clear all data
     st.markdown("### Clear All Expenses")
-    confirm = st.checkbox("Confirm deletion", key="confirm_clear_all")
-    if confirm:
-        if st.button("Clear ALL Expenses"):
-            engine = get_engine()
-            with engine.begin() as conn:
-                conn.execute(text("DELETE FROM expenses WHERE user_id=:uid"), {"uid": st.session_state['user_id']})
-            st.success("All your expense records cleared.")
-    else:
-        st.info("Check the box to confirm deletion.")
+    with st.form("admin_clear", clear_on_submit=True):
+        confirm = st.checkbox("Confirm deletion", key="confirm_clear_all")
+        submit = st.form_submit_button("Clear ALL Expenses")
+        if submit:
+            if confirm:
+                with get_engine().begin() as conn:
+                    conn.execute(text("DELETE FROM expenses WHERE user_id=:uid"), {"uid": st.session_state['user_id']})
+                clear_expense_caches()
+                st.success("All your expense records cleared.")
+            else:
+                st.info("Check the box to confirm deletion.")
 
     # Clear by date range
     st.markdown("### Delete Expenses by Date Range")
-    start_del = st.date_input("Start date", key="start_del")
-    end_del = st.date_input("End date", key="end_del")
-    if st.button("Delete Selected Range"):
-        if start_del > end_del:
-            st.error("Start date cannot be after end date.")
-        else:
-            engine = get_engine()
-            with engine.begin() as conn:
-                conn.execute(
-                    text("DELETE FROM expenses WHERE user_id=:uid AND date(dt) BETWEEN :start AND :end"),
-                    {"uid": st.session_state['user_id'], "start": start_del.strftime("%Y-%m-%d"), "end": end_del.strftime("%Y-%m-%d")}
-                )
-            st.success(f"Your expenses from {start_del} to {end_del} deleted.")
+    with st.form("admin_delete_range"):
+        start_del = st.date_input("Start date", key="start_del")
+        end_del = st.date_input("End date", key="end_del")
+        submit = st.form_submit_button("Delete Selected Range")
+        if submit:
+            if start_del > end_del:
+                st.error("Start date cannot be after end date.")
+            else:
+                with get_engine().begin() as conn:
+                    conn.execute(
+                        text("DELETE FROM expenses WHERE user_id=:uid AND dt BETWEEN :start AND :end || ' 23:59:59'"),
+                        {"uid": st.session_state['user_id'], "start": start_del.strftime("%Y-%m-%d"), "end": end_del.strftime("%Y-%m-%d")}
+                    )
+                clear_expense_caches()
+                st.success(f"Your expenses from {start_del} to {end_del} deleted.")